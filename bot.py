@@ -2,6 +2,9 @@
 TwitchIO bot implementation for BrickNPlateBot using LangChain
 """
 
+import re
+
+import regex
 from twitchio.ext import commands
 
 from config import (
@@ -13,6 +16,22 @@ from config import (
 )
 from agents import process_chat_message, process_event
 
+# Matches chat messages addressed to the bot, without lowercasing every line in the channel
+_BOT_RE = re.compile(r"bricknplatebot", re.IGNORECASE)
+
+# Twitch's chat message length limit
+TWITCH_MESSAGE_LIMIT = 500
+
+# Matches one user-perceived character (grapheme cluster), e.g. an emoji with modifiers
+_GRAPHEME_RE = regex.compile(r"\X")
+
+def _twitch_trim(s: str, limit: int = TWITCH_MESSAGE_LIMIT) -> str:
+    """Trim a message to Twitch's limit without splitting an emoji or accented character"""
+    clusters = _GRAPHEME_RE.findall(s)
+    if len(clusters) <= limit:
+        return s
+    return "".join(clusters[:limit - 3]) + "..."
+
 class BrickNPlateBot(commands.Bot):
     """Main Twitch bot class for BrickNPlateBot"""
     
@@ -37,17 +56,13 @@ class BrickNPlateBot(commands.Bot):
         if message.echo:
             return
         
-        # Check if the message is addressed to the bot
-        content = message.content.lower()
-        if "bricknplatebot" in content:
-            # Process the message with our agent
-            response = await process_chat_message(message.author.name, message.content)
-            
-            # Truncate response to fit Twitch's character limit
-            if len(response) > 500:
-                response = response[:497] + "..."
-                
-            await message.channel.send(response)
+        # Ignore messages that aren't addressed to the bot
+        if not _BOT_RE.search(message.content):
+            return
+        
+        # Process the message with our agent, sending each part as soon as it's ready
+        async for response in process_chat_message(message.author.name, message.content):
+            await message.channel.send(_twitch_trim(response))
     
     async def event_subscribe(self, event):
         """Called when a user subscribes to the channel."""
@@ -61,11 +76,7 @@ class BrickNPlateBot(commands.Bot):
             details={"tier": event.sub_plan}
         )
         
-        # Truncate message to fit Twitch's character limit
-        if len(message) > 500:
-            message = message[:497] + "..."
-            
-        await event.channel.send(message)
+        await event.channel.send(_twitch_trim(message))
     
     async def event_resub(self, event):
         """Called when a user resubscribes to the channel."""
@@ -88,11 +99,7 @@ class BrickNPlateBot(commands.Bot):
             }
         )
         
-        # Truncate message to fit Twitch's character limit
-        if len(message) > 500:
-            message = message[:497] + "..."
-            
-        await event.channel.send(message)
+        await event.channel.send(_twitch_trim(message))
     
     async def event_raid(self, event):
         """Called when the channel is raided."""
@@ -106,11 +113,7 @@ class BrickNPlateBot(commands.Bot):
             details={"viewers": event.viewers}
         )
         
-        # Truncate message to fit Twitch's character limit
-        if len(message) > 500:
-            message = message[:497] + "..."
-            
-        await event.channel.send(message)
+        await event.channel.send(_twitch_trim(message))
 
 def main():
     """Start the Twitch bot"""
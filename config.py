@@ -3,20 +3,51 @@ Configuration and environment variables for BrickNPlateBot
 """
 
 import os
-from datetime import datetime
+import time
+from collections import deque
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
 # Load environment variables
 load_dotenv()
 
+# Set DEBUG=1 to log every agent step and keep intermediate tool results
+DEBUG = os.getenv("DEBUG") == "1"
+
 # OpenAI API Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 # LangChain Model Configuration
-llm = ChatOpenAI(
+# Replies must fit in a Twitch message, so generation is capped at roughly 400 characters
+MAX_RESPONSE_TOKENS = 150
+
+# Tool-using chat replies
+llm_smart = ChatOpenAI(
     model="gpt-4-turbo-preview",
     temperature=0.7,
+    max_tokens=MAX_RESPONSE_TOKENS,
+    api_key=OPENAI_API_KEY
+)
+
+# Thank-you messages and formatting tool results
+llm_fast = ChatOpenAI(
+    model="gpt-4o-mini",
+    temperature=0.7,
+    max_tokens=MAX_RESPONSE_TOKENS,
+    api_key=OPENAI_API_KEY
+)
+
+# Summarizing chat history. Not capped like the chat models, so summaries are never
+# cut off mid-sentence; their size is kept in check by the memory in agents.py
+llm_summary = ChatOpenAI(
+    model="gpt-4o-mini",
+    temperature=0,
+    api_key=OPENAI_API_KEY
+)
+
+# Embedding model used to spot chat questions that have already been answered
+embeddings = OpenAIEmbeddings(
+    model="text-embedding-3-small",
     api_key=OPENAI_API_KEY
 )
 
@@ -34,10 +65,10 @@ TWITCH_CLIENT_SECRET = os.getenv("TWITCH_CLIENT_SECRET")
 # Stream Information Configuration
 STREAM_INFO_FILE = os.getenv("STREAM_INFO_FILE", "stream_info.yaml")
 
-# Track recent subscribers and raiders for context
+# Track recent subscribers and raiders for context (only the last 10 of each are kept)
 recent_events = {
-    "subscribers": [],
-    "raiders": []
+    "subscribers": deque(maxlen=10),
+    "raiders": deque(maxlen=10)
 }
 
 # Add a subscriber to recent events
@@ -47,21 +78,13 @@ def add_subscriber(username, tier=None, months=None, message=None):
         "tier": tier,
         "months": months,
         "message": message,
-        "timestamp": datetime.now()
+        "timestamp": time.time()
     })
-    
-    # Trim the list to keep only recent events
-    if len(recent_events["subscribers"]) > 10:
-        recent_events["subscribers"].pop(0)
 
 # Add a raider to recent events
 def add_raider(username, viewers=0):
     recent_events["raiders"].append({
         "username": username,
         "viewers": viewers,
-        "timestamp": datetime.now()
+        "timestamp": time.time()
     })
-    
-    # Trim the list to keep only recent events
-    if len(recent_events["raiders"]) > 10:
-        recent_events["raiders"].pop(0)
@@ -2,9 +2,18 @@
 LangChain tools for BrickNPlateBot
 """
 
+import asyncio
+import contextvars
+import functools
+import inspect
+import json
 import yaml
 import os
-import requests
+import time
+import threading
+import aiofiles
+import httpx
+from cachetools import TTLCache
 from typing import Dict, List, Optional, Union, Any
 
 from langchain.tools import BaseTool, StructuredTool
@@ -35,22 +44,89 @@ class StreamInfoInput(BaseModel):
         description="The category of information to retrieve (e.g., 'current_build', 'schedule', 'upcoming_builds', 'channel_info', 'faq'). If not specified, returns all information."
     )
 
+# Shared async HTTP client so Rebrickable and Twitch connections are kept alive between
+# tool calls, without blocking the TwitchIO event loop while requests are in flight
+HTTP_CLIENT = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+    timeout=10.0
+)
+
+# Rebrickable set data rarely changes, so keep lookups around for a day
+LEGO_CACHE_TTL = 86400
+_lego_set_cache = TTLCache(maxsize=1024, ttl=LEGO_CACHE_TTL)
+_lego_search_cache = TTLCache(maxsize=1024, ttl=LEGO_CACHE_TTL)
+_lego_cache_lock = threading.Lock()
+
+# Tool results from the current agent run, keyed by tool name and arguments.
+# None outside of a run, so calls made outside an agent run are never memoized.
+_tool_run_cache: contextvars.ContextVar[Optional[Dict]] = contextvars.ContextVar("tool_run_cache", default=None)
+
+def start_tool_run():
+    """Give the current agent run a fresh tool result cache."""
+    _tool_run_cache.set({})
+
+def end_tool_run():
+    """Drop the tool result cache for the agent run that just finished."""
+    # Set rather than reset with a token: an abandoned chat generator is closed later
+    # from a different task, where resetting a token from this context would fail
+    _tool_run_cache.set(None)
+
+def tools_used_in_run() -> List[str]:
+    """Get the names of the tools called so far in the current agent run."""
+    run_cache = _tool_run_cache.get() or {}
+    return [tool_name for tool_name, _ in run_cache]
+
+def memoize_per_run(func):
+    """Return the earlier result when a tool is called twice with the same arguments in one run."""
+    signature = inspect.signature(func)
+    
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        run_cache = _tool_run_cache.get()
+        if run_cache is None:
+            return await func(*args, **kwargs)
+        
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        key = (func.__name__, json.dumps(arguments.arguments, sort_keys=True, default=str))
+        if key not in run_cache:
+            run_cache[key] = await func(*args, **kwargs)
+        return run_cache[key]
+    
+    return wrapper
+
 # Tool functions
-def get_lego_set_info(set_num: str) -> Dict:
+@memoize_per_run
+async def get_lego_set_info(set_num: str) -> Dict:
     """Get detailed information about a specific Lego set."""
+    set_num = set_num.strip()
+    with _lego_cache_lock:
+        if set_num in _lego_set_cache:
+            return _lego_set_cache[set_num]
+    
     try:
         headers = {
             "Authorization": f"key {REBRICKABLE_API_KEY}"
         }
-        response = requests.get(f"{REBRICKABLE_BASE_URL}/lego/sets/{set_num}/", headers=headers)
+        response = await HTTP_CLIENT.get(f"{REBRICKABLE_BASE_URL}/lego/sets/{set_num}/", headers=headers)
         response.raise_for_status()
-        return response.json()
+        set_info = response.json()
+        
+        with _lego_cache_lock:
+            _lego_set_cache[set_num] = set_info
+        return set_info
     except Exception as e:
         print(f"Error fetching Lego set {set_num}: {str(e)}")
         return {"error": f"Could not find information for set {set_num}"}
 
-def search_lego_sets(query: str) -> List[Dict]:
+@memoize_per_run
+async def search_lego_sets(query: str) -> List[Dict]:
     """Search for Lego sets by name or theme."""
+    query = query.strip().lower()
+    with _lego_cache_lock:
+        if query in _lego_search_cache:
+            return _lego_search_cache[query]
+    
     try:
         headers = {
             "Authorization": f"key {REBRICKABLE_API_KEY}"
@@ -58,80 +134,101 @@ def search_lego_sets(query: str) -> List[Dict]:
         params = {
             "search": query
         }
-        response = requests.get(f"{REBRICKABLE_BASE_URL}/lego/sets/", headers=headers, params=params)
+        response = await HTTP_CLIENT.get(f"{REBRICKABLE_BASE_URL}/lego/sets/", headers=headers, params=params)
         response.raise_for_status()
-        results = response.json().get("results", [])
-        return results[:5]  # Return top 5 results
+        results = response.json().get("results", [])[:5]  # Keep top 5 results
+        
+        with _lego_cache_lock:
+            _lego_search_cache[query] = results
+        return results
     except Exception as e:
         print(f"Error searching for Lego sets with query '{query}': {str(e)}")
         return {"error": f"Could not find any sets matching '{query}'"}
 
-def get_twitch_user_info(username: str) -> Dict:
-    """Get information about a Twitch user using Twitch API."""
-    try:
-        # Step 1: Get an app access token
-        auth_url = "https://id.twitch.tv/oauth2/token"
-        auth_params = {
-            "client_id": TWITCH_CLIENT_ID,
-            "client_secret": TWITCH_CLIENT_SECRET,
-            "grant_type": "client_credentials"
-        }
-        auth_response = requests.post(auth_url, params=auth_params)
-        auth_response.raise_for_status()
-        access_token = auth_response.json()["access_token"]
-        
-        # Step 2: Get user ID from username
+# App access token for the Twitch API, refreshed only when it expires
+_twitch_token = {"token": None, "expires_at": 0}
+
+async def get_twitch_access_token() -> str:
+    """Get a Twitch app access token, requesting a new one only when needed."""
+    # Refresh a minute early so the token never expires mid-request
+    if _twitch_token["token"] and time.time() < _twitch_token["expires_at"] - 60:
+        return _twitch_token["token"]
+    
+    auth_url = "https://id.twitch.tv/oauth2/token"
+    auth_params = {
+        "client_id": TWITCH_CLIENT_ID,
+        "client_secret": TWITCH_CLIENT_SECRET,
+        "grant_type": "client_credentials"
+    }
+    auth_response = await HTTP_CLIENT.post(auth_url, params=auth_params)
+    auth_response.raise_for_status()
+    auth_data = auth_response.json()
+    
+    _twitch_token["token"] = auth_data["access_token"]
+    _twitch_token["expires_at"] = time.time() + auth_data.get("expires_in", 0)
+    return _twitch_token["token"]
+
+async def twitch_api_get(url: str, params: Any) -> httpx.Response:
+    """Make an authenticated Helix GET request, retrying once with a fresh token on 401."""
+    for attempt in range(2):
+        access_token = await get_twitch_access_token()
         headers = {
             "Client-ID": TWITCH_CLIENT_ID,
             "Authorization": f"Bearer {access_token}"
         }
+        response = await HTTP_CLIENT.get(url, headers=headers, params=params)
+        
+        # Tokens can be revoked before they expire (e.g. when the client secret
+        # rotates), so drop the cached one and try again with a new token
+        if response.status_code == 401 and attempt == 0:
+            _twitch_token["token"] = None
+            _twitch_token["expires_at"] = 0
+            continue
         
-        # Get user data
+        response.raise_for_status()
+        return response
+
+@memoize_per_run
+async def get_twitch_user_info(username: str) -> Dict:
+    """Get information about a Twitch user using Twitch API."""
+    try:
+        # Step 1: Look up the user and the broadcaster in a single request
+        user_login = username.lower()
+        channel_name = TWITCH_CHANNEL.lower().lstrip('#')
         users_url = "https://api.twitch.tv/helix/users"
-        users_params = {"login": username.lower()}
-        users_response = requests.get(users_url, headers=headers, params=users_params)
-        users_response.raise_for_status()
+        users_params = [("login", user_login), ("login", channel_name)]
+        users_response = await twitch_api_get(users_url, users_params)
         
-        user_data = users_response.json()
-        if not user_data["data"]:
+        users_by_login = {user["login"]: user for user in users_response.json()["data"]}
+        if user_login not in users_by_login:
             return {"error": f"User '{username}' not found on Twitch"}
         
-        user_id = user_data["data"][0]["id"]
-        user_info = user_data["data"][0]
-        
-        # Step 3: Get channel information
-        channel_url = f"https://api.twitch.tv/helix/channels?broadcaster_id={user_id}"
-        channel_response = requests.get(channel_url, headers=headers)
-        channel_response.raise_for_status()
-        channel_data = channel_response.json()["data"][0] if channel_response.json()["data"] else {}
-        
-        # Step 4: Check if user follows this channel
-        channel_name = TWITCH_CHANNEL.lower().lstrip('#')
-        broadcaster_id = None
+        user_info = users_by_login[user_login]
+        user_id = user_info["id"]
+        broadcaster = users_by_login.get(channel_name)
         
-        # Get broadcaster ID
-        broadcaster_params = {"login": channel_name}
-        broadcaster_response = requests.get(users_url, headers=headers, params=broadcaster_params)
-        broadcaster_response.raise_for_status()
-        broadcaster_data = broadcaster_response.json()
+        # Step 2: Get channel information and follow status at the same time
+        async def get_channel_data() -> Dict:
+            channel_url = "https://api.twitch.tv/helix/channels"
+            channel_response = await twitch_api_get(channel_url, {"broadcaster_id": user_id})
+            channel_data = channel_response.json()["data"]
+            return channel_data[0] if channel_data else {}
         
-        if broadcaster_data["data"]:
-            broadcaster_id = broadcaster_data["data"][0]["id"]
-            
-            # Check follow status
+        async def get_following_since() -> Optional[str]:
+            if not broadcaster:
+                return None
             follows_url = "https://api.twitch.tv/helix/channels/followers"
             follows_params = {
-                "broadcaster_id": broadcaster_id,
+                "broadcaster_id": broadcaster["id"],
                 "user_id": user_id
             }
-            follows_response = requests.get(follows_url, headers=headers, params=follows_params)
-            follows_response.raise_for_status()
-            
+            follows_response = await twitch_api_get(follows_url, follows_params)
             follow_data = follows_response.json()
-            following_since = None
-            
             if "data" in follow_data and follow_data["data"]:
-                following_since = follow_data["data"][0]["followed_at"]
+                return follow_data["data"][0]["followed_at"]
+            return None
+        
+        channel_data, following_since = await asyncio.gather(get_channel_data(), get_following_since())
         
         # Compile user information
         result = {
@@ -142,8 +239,8 @@ def get_twitch_user_info(username: str) -> Dict:
             "description": user_info["description"],
             "broadcaster_type": user_info["broadcaster_type"],
             "channel": channel_data,
-            "following_since": following_since if 'following_since' in locals() else None,
-            "is_following": 'following_since' in locals() and following_since is not None
+            "following_since": following_since,
+            "is_following": following_since is not None
         }
         
         return result
@@ -152,19 +249,37 @@ def get_twitch_user_info(username: str) -> Dict:
         print(f"Error fetching Twitch user info for {username}: {str(e)}")
         return {"error": f"Could not fetch information for user {username}: {str(e)}"}
 
-def get_stream_info(category: Optional[str] = None) -> Dict:
+# Parsed stream info, reloaded only when the file's modification time changes
+_STREAM_INFO_CACHE = {"mtime": 0, "data": None}
+
+# Use the libyaml-backed loader when PyYAML was built with it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+def get_stream_info_mtime() -> float:
+    """Get the last modification time of the stream info file, or 0 if it doesn't exist."""
+    try:
+        return os.stat(STREAM_INFO_FILE).st_mtime
+    except OSError:
+        return 0
+
+@memoize_per_run
+async def get_stream_info(category: Optional[str] = None) -> Dict:
     """Get information about the stream based on the specified category."""
     try:
         # Load the stream info file
         if os.path.exists(STREAM_INFO_FILE):
-            with open(STREAM_INFO_FILE, 'r', encoding='utf-8') as file:
-                stream_info = yaml.safe_load(file)
+            mtime = os.stat(STREAM_INFO_FILE).st_mtime
+            if _STREAM_INFO_CACHE["data"] is None or mtime != _STREAM_INFO_CACHE["mtime"]:
+                async with aiofiles.open(STREAM_INFO_FILE, 'r', encoding='utf-8') as file:
+                    _STREAM_INFO_CACHE["data"] = yaml.load(await file.read(), Loader=YAML_LOADER)
+                _STREAM_INFO_CACHE["mtime"] = mtime
+            stream_info = _STREAM_INFO_CACHE["data"]
         else:
             # Create a default stream info file if it doesn't exist
             stream_info = create_default_stream_info()
             
-            with open(STREAM_INFO_FILE, 'w', encoding='utf-8') as file:
-                yaml.dump(stream_info, file, default_flow_style=False)
+            async with aiofiles.open(STREAM_INFO_FILE, 'w', encoding='utf-8') as file:
+                await file.write(yaml.dump(stream_info, default_flow_style=False))
             
             print(f"Created default stream info file at {STREAM_INFO_FILE}")
         
@@ -220,38 +335,38 @@ def create_default_stream_info() -> Dict:
         ]
     }
 
-# Create LangChain tools
+# Create LangChain tools once (async only; the agents are always run with ainvoke)
+BOT_TOOLS = [
+    StructuredTool.from_function(
+        coroutine=get_lego_set_info,
+        name="get_lego_set_info",
+        description="Get detailed information about a specific Lego set by set number",
+        args_schema=LegoSetInput,
+        return_direct=False
+    ),
+    StructuredTool.from_function(
+        coroutine=search_lego_sets,
+        name="search_lego_sets",
+        description="Search for Lego sets by name or theme",
+        args_schema=LegoSearchInput,
+        return_direct=False
+    ),
+    StructuredTool.from_function(
+        coroutine=get_twitch_user_info,
+        name="get_twitch_user_info",
+        description="Get information about a Twitch user in the context of this channel",
+        args_schema=TwitchUserInput,
+        return_direct=False
+    ),
+    StructuredTool.from_function(
+        coroutine=get_stream_info,
+        name="get_stream_info",
+        description="Get information about the stream like schedule, current build, etc.",
+        args_schema=StreamInfoInput,
+        return_direct=False
+    )
+]
+
 def get_bot_tools():
     """Get all tools for the bot."""
-    tools = [
-        StructuredTool.from_function(
-            func=get_lego_set_info,
-            name="get_lego_set_info",
-            description="Get detailed information about a specific Lego set by set number",
-            args_schema=LegoSetInput,
-            return_direct=False
-        ),
-        StructuredTool.from_function(
-            func=search_lego_sets,
-            name="search_lego_sets",
-            description="Search for Lego sets by name or theme",
-            args_schema=LegoSearchInput,
-            return_direct=False
-        ),
-        StructuredTool.from_function(
-            func=get_twitch_user_info,
-            name="get_twitch_user_info",
-            description="Get information about a Twitch user in the context of this channel",
-            args_schema=TwitchUserInput,
-            return_direct=False
-        ),
-        StructuredTool.from_function(
-            func=get_stream_info,
-            name="get_stream_info",
-            description="Get information about the stream like schedule, current build, etc.",
-            args_schema=StreamInfoInput,
-            return_direct=False
-        )
-    ]
-    
-    return tools
+    return BOT_TOOLS